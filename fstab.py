@@ -0,0 +1,240 @@
+"""Parse, manipulate and write /etc/fstab files.
+
+Based on the python-fstab module (Copyright 2008 Canonical Ltd,
+GPL v3), trimmed down and ported to Python 3 for the cloudstor agent.
+"""
+
+import mmap
+import os
+import tempfile
+
+# Above this size, read() maps the file instead of copying it into a
+# userspace buffer; typical fstabs stay well under it, but mount
+# tables on busy container hosts can run to megabytes.
+_MMAP_THRESHOLD = 64 * 1024
+
+
+class Line(object):
+    """A line in an /etc/fstab file.
+
+    Lines may or may not have a filesystem specification in them. The
+    has_filesystem method tells the user whether they do or not; if
+    they do, the attributes device, directory, fstype, options, dump
+    and fsck contain the values of the corresponding fields. The
+    original line is available via the raw attribute, and assigning to
+    it re-parses the line.
+    """
+
+    __slots__ = ("_device", "_directory", "_fstype",
+                 "_options", "_dump", "_fsck",
+                 "_raw", "_parsed")
+
+    def __init__(self, raw):
+        self.raw = raw
+
+    def _check_parsed(self, name):
+        if not self._parsed:
+            raise Exception("Cannot set attribute %s when line does not "
+                            "contain filesystem specification" % name)
+
+    def get_device(self):
+        return self._device
+
+    def set_device(self, value):
+        self._check_parsed("device")
+        self._device = value
+        self._raw = None
+
+    device = property(get_device, set_device)
+
+    def get_directory(self):
+        return self._directory
+
+    def set_directory(self, value):
+        self._check_parsed("directory")
+        self._directory = value
+        self._raw = None
+
+    directory = property(get_directory, set_directory)
+
+    def get_fstype(self):
+        return self._fstype
+
+    def set_fstype(self, value):
+        self._check_parsed("fstype")
+        self._fstype = value
+        self._raw = None
+
+    fstype = property(get_fstype, set_fstype)
+
+    def get_options(self):
+        return self._options.split(",")
+
+    def set_options(self, value):
+        self._check_parsed("options")
+        self._options = ",".join(value)
+        self._raw = None
+
+    options = property(get_options, set_options)
+
+    def get_dump(self):
+        return self._dump
+
+    def set_dump(self, value):
+        self._check_parsed("dump")
+        self._dump = int(value)
+        self._raw = None
+
+    dump = property(get_dump, set_dump)
+
+    def get_fsck(self):
+        return self._fsck
+
+    def set_fsck(self, value):
+        self._check_parsed("fsck")
+        self._fsck = int(value)
+        self._raw = None
+
+    fsck = property(get_fsck, set_fsck)
+
+    def set_raw(self, raw):
+        parsed = False
+
+        stripped = raw.strip()
+        if stripped and not stripped.startswith("#"):
+            parts = raw.split()
+            if (len(parts) == 6 and
+                    parts[4].isdigit() and parts[5].isdigit()):
+                (self._device, self._directory, self._fstype,
+                 self._options) = parts[:4]
+                self._dump = int(parts[4])
+                self._fsck = int(parts[5])
+                parsed = True
+
+        if not parsed:
+            self._device = self._directory = self._fstype = None
+            self._options = self._dump = self._fsck = None
+        self._parsed = parsed
+        self._raw = raw
+
+    def get_raw(self):
+        raw = self._raw
+        if raw is None:
+            # A field was mutated since the line was parsed, so the
+            # original spacing is gone; emit a normalised line and
+            # cache it until the next mutation.
+            raw = "%s %s %s %s %d %d\n" % (
+                self._device, self._directory, self._fstype,
+                self._options, self._dump, self._fsck)
+            self._raw = raw
+        return raw
+
+    raw = property(get_raw, set_raw)
+
+    def has_filesystem(self):
+        """Does this line have a filesystem specification?"""
+        return self._parsed
+
+
+class Fstab(object):
+    """An /etc/fstab file."""
+
+    def __init__(self, path="/etc/fstab"):
+        self.path = path
+        self.lines = []
+        self._by_dir = {}
+
+    def read(self):
+        """Read the fstab from disk, replacing any parsed lines."""
+        with open(self.path, "r") as f:
+            if os.fstat(f.fileno()).st_size > _MMAP_THRESHOLD:
+                lines = self._read_mmap(f)
+            else:
+                data = f.read()
+                lines = [Line(line)
+                         for line in data.splitlines(keepends=True)]
+        self.lines = lines
+        # Non-filesystem lines are skipped up front; reading the
+        # slots directly keeps the per-line cost of the index build
+        # to two slot loads.
+        self._by_dir = {line._directory: i for i, line in enumerate(lines)
+                        if line._parsed}
+
+    def _read_mmap(self, f):
+        """Parse a large fstab through a read-only mapping.
+
+        Lets the kernel page the file in on demand instead of copying
+        the whole buffer into userspace first.
+        """
+        mm = mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ)
+        try:
+            if hasattr(mm, "madvise"):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            return [Line(line.decode()) for line in iter(mm.readline, b"")]
+        finally:
+            mm.close()
+
+    def get_entry(self, directory):
+        """Return the Line mounted on directory, or None."""
+        idx = self._by_dir.get(directory)
+        if idx is None:
+            return None
+        return self.lines[idx]
+
+    def delete_entry(self, directory):
+        """Remove any entry mounted on directory."""
+        idx = self._by_dir.pop(directory, None)
+        if idx is None:
+            return
+        del self.lines[idx]
+        for d, i in self._by_dir.items():
+            if i > idx:
+                self._by_dir[d] = i - 1
+
+    def add_entry(self, device, directory, fstype, options,
+                  dump=0, fsck=0):
+        """Add an entry for directory, replacing any existing one."""
+        self.delete_entry(directory)
+        raw = "%s %s %s %s %s %s\n" % (device, directory, fstype,
+                                       options, dump, fsck)
+        self._by_dir[directory] = len(self.lines)
+        self.lines.append(Line(raw))
+
+    def write(self):
+        """Write the fstab back to disk atomically, keeping a backup."""
+        dirname = os.path.dirname(self.path)
+        prefix = os.path.basename(self.path) + "."
+        fd, tempname = tempfile.mkstemp(dir=dirname, prefix=prefix)
+        os.close(fd)
+
+        with open(tempname, "w") as f:
+            f.write("".join(line.raw for line in self.lines))
+            # Make sure the data blocks are on disk before the rename
+            # publishes them; a crash must never leave a truncated
+            # fstab behind.
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.chmod_file(tempname, self.get_perms(self.path))
+
+        # Back up the old file by hardlinking it under a temporary
+        # name and renaming over any previous backup, then atomically
+        # replace the fstab itself; neither path ever briefly
+        # disappears.
+        bakname = tempname + ".bak"
+        os.link(self.path, bakname)
+        os.replace(bakname, self.path + ".bak")
+        os.replace(tempname, self.path)
+
+        # Persist the renames themselves by syncing the directory.
+        dfd = os.open(dirname or ".", os.O_RDONLY)
+        try:
+            os.fsync(dfd)
+        finally:
+            os.close(dfd)
+
+    def get_perms(self, filename):
+        return os.stat(filename).st_mode
+
+    def chmod_file(self, filename, mode):
+        os.chmod(filename, mode)
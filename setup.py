@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""Configure and mount CloudStor (AARNet ownCloud) via davfs2.
+
+Fetches the instance's CloudStor app credentials from the Nectar
+vendor data service, records them in /etc/davfs2/secrets, adds an
+fstab entry for the default login user and mounts the share.
+"""
+
+import logging
+import os
+import pwd
+import subprocess
+import sys
+import tempfile
+
+from functools import lru_cache
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import fstab
+
+
+LOG = logging.getLogger(__name__)
+
+# One session for the whole run so the CloudStor probe (and any
+# retry) reuses the pooled TLS connection instead of handshaking
+# again.
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=1, pool_maxsize=2,
+    max_retries=Retry(total=2, backoff_factor=0.3,
+                      status_forcelist=(503,))))
+
+VENDOR_DATA_URL = "http://169.254.169.254/openstack/latest/vendor_data2.json"
+CLOUDSTOR_URL = "https://cloudstor.aarnet.edu.au/plus/remote.php/webdav/"
+SECRETS_FILE = "/etc/davfs2/secrets"
+MOUNT_DIR_NAME = "CloudStor"
+
+# Secrets entries owned by this agent, matched as bytes so the
+# filter never has to decode the file; a tuple so more URLs can be
+# claimed later.
+SECRET_PREFIXES = (CLOUDSTOR_URL.encode(),)
+
+# The default login user created by cloud-init.
+DEFAULT_UID = 1000
+
+
+@lru_cache(maxsize=1)
+def get_default_user():
+    """Return the pwd entry of the default login user.
+
+    Cached for the life of the process; the default user cannot
+    change during a single setup run.
+    """
+    return pwd.getpwuid(DEFAULT_UID)
+
+
+def get_mount_point():
+    """Return the mount point path in the default user's home."""
+    return os.path.join(get_default_user().pw_dir, MOUNT_DIR_NAME)
+
+
+def get_credentials():
+    """Fetch the CloudStor credentials from the vendor data service."""
+    r = SESSION.get(VENDOR_DATA_URL, timeout=10)
+    r.raise_for_status()
+    data = r.json().get("cloudstor", {})
+    return data.get("username"), data.get("password")
+
+
+def test_cloudstor_creds(username, password):
+    """Check that CloudStor accepts the credentials.
+
+    Only the status code matters, so probe with HEAD and avoid
+    downloading the WebDAV directory listing a GET would return.
+    """
+    r = SESSION.head(CLOUDSTOR_URL, auth=(username, password),
+                     timeout=10, allow_redirects=True)
+    if r.status_code == 405:
+        # Server refuses HEAD; fall back to GET but drop the body
+        # without reading it.
+        r = SESSION.get(CLOUDSTOR_URL, auth=(username, password),
+                        timeout=10, stream=True)
+        r.close()
+    r.raise_for_status()
+
+
+def add_davfs2_secret(username, password, secrets_file=SECRETS_FILE):
+    """Record the credentials in the davfs2 secrets file.
+
+    The filtered content and the new entry are streamed to a
+    temporary file which atomically replaces the secrets file, so a
+    crash can never leave it truncated or with the entry missing.
+    """
+    quoted = password.replace("\\", "\\\\").replace('"', '\\"')
+    dirname = os.path.dirname(secrets_file)
+    tmp = tempfile.NamedTemporaryFile(mode="wb", dir=dirname, delete=False)
+    try:
+        with open(secrets_file, "rb") as src:
+            for line in src:
+                if not line.startswith(SECRET_PREFIXES):
+                    tmp.write(line)
+        tmp.write(('%s %s "%s"\n'
+                   % (CLOUDSTOR_URL, username, quoted)).encode())
+        tmp.flush()
+        os.fsync(tmp.fileno())
+        tmp.close()
+        # davfs2 insists the secrets file is only readable by its
+        # owner.
+        os.chmod(tmp.name, 0o600)
+        os.replace(tmp.name, secrets_file)
+    except Exception:
+        tmp.close()
+        os.unlink(tmp.name)
+        raise
+    dfd = os.open(dirname, os.O_RDONLY)
+    try:
+        os.fsync(dfd)
+    finally:
+        os.close(dfd)
+
+
+def add_fstab_entry():
+    """Add the davfs mount for the default user to /etc/fstab."""
+    user = get_default_user()
+    mount_point = get_mount_point()
+    if not os.path.isdir(mount_point):
+        os.mkdir(mount_point)
+        os.chown(mount_point, user.pw_uid, user.pw_gid)
+    f = fstab.Fstab()
+    f.read()
+    options = "noauto,user,uid=%d,gid=%d" % (user.pw_uid, user.pw_gid)
+    f.add_entry(CLOUDSTOR_URL, mount_point, "davfs", options)
+    f.write()
+
+
+def is_mounted():
+    """Is the CloudStor share currently mounted?"""
+    return os.path.ismount(get_mount_point())
+
+
+def mount():
+    """Mount the CloudStor share, returning True on success."""
+    res = subprocess.run(["/bin/mount", get_mount_point()],
+                         capture_output=True, text=True)
+    if res.returncode:
+        LOG.error("mount failed: %s", res.stderr)
+        return False
+    return True
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    username, password = get_credentials()
+    if not username or not password:
+        LOG.info("No CloudStor credentials in vendor data; nothing to do")
+        return 0
+    try:
+        test_cloudstor_creds(username, password)
+    except requests.HTTPError:
+        LOG.error("CloudStor rejected the supplied credentials")
+        return 1
+    add_davfs2_secret(username, password)
+    add_fstab_entry()
+    if not is_mounted() and not mount():
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())